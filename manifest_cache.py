@@ -0,0 +1,58 @@
+import gzip
+import os
+from urllib.parse import urlsplit
+
+import requests
+
+COMMON_CRAWL_URL = "https://data.commoncrawl.org"
+
+
+def snapshot_warc_paths_url(snapshot):
+    """スナップショット名（例: CC-MAIN-2024-18）からwarc.paths.gzのURLを作る"""
+    return f"{COMMON_CRAWL_URL}/crawl-data/{snapshot}/warc.paths.gz"
+
+
+def fetch_warc_paths(warc_paths_url, cache_dir, timeout=60):
+    """
+    warc.paths.gzをcache_dirにキャッシュしながら読み込む。
+    キャッシュがあればETagを付けて条件付きリクエストを送り、304なら再ダウンロードしない。
+    ダウンロードに失敗してもキャッシュがあればそれを使う
+    :param warc_paths_url: warc.paths.gzのURL
+    :param cache_dir: キャッシュの保存先フォルダ
+    :return: warcファイルのパスのリスト
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    # crawl-data/CC-MAIN-2024-18/warc.paths.gz -> crawl-data_CC-MAIN-2024-18_warc.paths.gz
+    cache_name = urlsplit(warc_paths_url).path.strip("/").replace("/", "_")
+    cache_path = os.path.join(cache_dir, cache_name)
+    etag_path = cache_path + ".etag"
+
+    headers = {}
+    if os.path.exists(cache_path) and os.path.exists(etag_path):
+        with open(etag_path, "r", encoding="utf-8") as f:
+            headers["If-None-Match"] = f.read().strip()
+
+    try:
+        response = requests.get(warc_paths_url, headers=headers, timeout=timeout)
+        if response.status_code == 304:
+            print(f"{warc_paths_url}: not modified, using cached manifest.")
+        elif response.status_code == 200:
+            # 書き込み途中で落ちても壊れたキャッシュが残らないように一時ファイル経由で置き換える
+            with open(cache_path + ".tmp", "wb") as f:
+                f.write(response.content)
+            os.replace(cache_path + ".tmp", cache_path)
+            etag = response.headers.get("ETag")
+            if etag:
+                with open(etag_path, "w", encoding="utf-8") as f:
+                    f.write(etag)
+            elif os.path.exists(etag_path):
+                os.remove(etag_path)
+        else:
+            raise Exception(f"{warc_paths_url}: Got response.status_code == {response.status_code}")
+    except Exception as e:
+        if not os.path.exists(cache_path):
+            raise
+        print(f"{e}\nUsing cached manifest: {cache_path}")
+
+    with gzip.open(cache_path, "rt", encoding="utf-8") as f:
+        return f.read().splitlines()
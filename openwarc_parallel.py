@@ -1,15 +1,14 @@
 import argparse
 import base64
 import concurrent
-import gzip
 import json
 import logging
 import os
-import shutil
 import signal
 import sys
 import time
 import traceback
+from collections import Counter, deque
 from concurrent.futures import ProcessPoolExecutor
 
 import requests
@@ -23,6 +22,15 @@ from warcio.archiveiterator import ArchiveIterator
 from multiprocessing import freeze_support
 
 from lang_predictor import FastTextLangPredictor
+from manifest_cache import fetch_warc_paths, snapshot_warc_paths_url
+from parallel_gzip import ParallelGzipReader
+from quality_filter import QualityFilter
+from record_prefilter import get_record_prefilter
+from seekable_zstd import SeekableZstdWriter, write_index
+from shard_stats import ShardStats, write_rollup, write_shard_stats
+from task_profiler import run_with_profile, write_profile_report
+from warc_planner import load_warc_yields, plan_warcs
+from worker_autoscaler import WorkerAutoscaler
 from xml_parser import XMLMetadataParser
 
 
@@ -95,7 +103,10 @@ def download_warc_file(warc_url, max_retries=5, retry_delay=5):
     return None
 
 
-def process_warc(warc_path, use_fast_text=True, trafilatura_timeout=30, current_trial=0, process_max_trial=-1, dl_max_trial=-1, enable_text_extraction_from_html=True):
+def process_warc(warc_path, use_fast_text=True, trafilatura_timeout=30, current_trial=0, process_max_trial=-1, dl_max_trial=-1, enable_text_extraction_from_html=True,
+                 decompression_threads=0, decompression_chunk_size=8 * 1024 * 1024,
+                 max_payload_bytes=0, payload_overflow="truncate", lang_detect_prefix_bytes=0,
+                 quality_thresholds=None, prefilter_config=None):
     """
     warcファイルを読み込んで、日本語ページかどうかの簡単なフィルタリングを行う。
     処理手順:
@@ -104,10 +115,20 @@ def process_warc(warc_path, use_fast_text=True, trafilatura_timeout=30, current_
     3. 解凍したデータをイテレートする
     4. 日本語を対象として配列に追加
     :param warc_path: warcファイルの場所
-    :return: (is_succeed, warc_path, ja_soup_list)
+    :param decompression_threads: gzipメンバーを並列解凍するスレッド数。1以下ならwarcio標準の逐次解凍
+    :param decompression_chunk_size: 並列解凍の1チャンクあたりの圧縮データサイズ（バイト）
+    :param max_payload_bytes: htmlをこのバイト数までしか読み込まない。0なら無制限
+    :param payload_overflow: max_payload_bytesを超えたhtmlの扱い。"truncate"なら切り詰め、"skip"ならスキップ
+    :param lang_detect_prefix_bytes: FastTextによる言語判定でhtmlの先頭からこのバイト数だけを見る。0なら全体
+    :param quality_thresholds: Noneでない場合、抽出したテキストの品質シグナルをwarcファイル単位でまとめて計算し、
+                               この閾値（quality_filter.DEFAULT_THRESHOLDSを上書き）でrejected/rejected_reasonを設定する
+    :param prefilter_config: RecordPreFilterの引数。本文を読む前にMIMEタイプ・Content-Length・URLでレコードをスキップする
+    :return: (is_succeed, warc_path, ja_soup_list, reason_counts, task_stats)
     is_succeed: bool - 処理が成功したかどうか。なんらかの例外が発生するとFalseになる
     warc_path: str - 処理対象のwarcファイル名。入力のwarc_pathと同じ
     ja_soup_list: list[dict] - 処理済みのデータ
+    reason_counts: Counter - 切り詰めやスキップを行ったレコード数（理由ごと）。プレフィルタでスキップしたレコードも含む
+    task_stats: dict - 経過時間（wall_time）、CPU時間（cpu_time）、ダウンロードしたバイト数（download_bytes）
     """
     def lang_detect(xml_data, metadata_parser: XMLMetadataParser, lang_detector: FastTextLangPredictor):
         meta_description = metadata_parser.parse_description(xml_data)
@@ -128,6 +149,17 @@ def process_warc(warc_path, use_fast_text=True, trafilatura_timeout=30, current_
 
     print(f"Start: {warc_path}")
     result_list = []
+    reason_counts = Counter()
+    start_wall_time = time.time()
+    start_cpu_time = time.process_time()
+    response = None
+
+    def get_task_stats():
+        return {
+            "wall_time": time.time() - start_wall_time,
+            "cpu_time": time.process_time() - start_cpu_time,
+            "download_bytes": response.raw.tell() if response is not None else 0,
+        }
 
     try:
         metadata_parser = None
@@ -137,6 +169,8 @@ def process_warc(warc_path, use_fast_text=True, trafilatura_timeout=30, current_
             metadata_parser = XMLMetadataParser()
             # fasttextを使用して言語判定するやつ
             lang_predictor = FastTextLangPredictor()
+        # ヘッダーとURLだけでレコードを判定するやつ（ワーカープロセスごとに1回だけ構築する）
+        record_prefilter = get_record_prefilter(prefilter_config)
 
         # WARCファイルのURLを構築
         warc_url = f"https://data.commoncrawl.org/{warc_path}"
@@ -144,71 +178,112 @@ def process_warc(warc_path, use_fast_text=True, trafilatura_timeout=30, current_
         # WARCファイルをダウンロード
         response = download_warc_file(warc_url, max_retries=dl_max_trial, retry_delay=1)
 
-        tmp_content = None
-        for record in ArchiveIterator(response.raw):
-            if record.rec_type == 'response' and record.http_headers.get_header('Content-Type') == 'text/html':
-                tmp_content = record.content_stream().read()
+        # 並列解凍が有効な場合は解凍済みのストリームをArchiveIteratorに渡す
+        stream = response.raw
+        if decompression_threads > 1:
+            stream = ParallelGzipReader(response.raw, num_threads=decompression_threads, chunk_size=decompression_chunk_size)
 
-            elif record.rec_type == 'metadata':
-                if tmp_content is None:
-                    continue
-
-                # メタデータのパース
-                metadata = parse_metadata(record.content_stream().read())
+        # 例外でリトライする場合も並列解凍のスレッドが残らないように必ず閉じる
+        try:
+            tmp_content = None
+            payload_truncated = False
+            for record in ArchiveIterator(stream):
+                if record.rec_type == 'response':
+                    # 前のレスポンスが残っていれば捨てる（対応するmetadataが無かった）
+                    tmp_content = None
+                    payload_truncated = False
+                    # 本文を読み込む前にヘッダーとURLで判定する
+                    skip_reason = record_prefilter.check(record)
+                    if skip_reason is not None:
+                        reason_counts[skip_reason] += 1
+                        continue
 
-                # cld2の解析が失敗 or languagesが存在しない場合スキップ
-                if "languages-cld2" not in metadata or "languages" not in metadata["languages-cld2"]:
-                    continue
+                    if max_payload_bytes > 0:
+                        # 上限+1バイトだけ読んで上限を超えているかを判定する。残りはArchiveIteratorが読み飛ばす
+                        tmp_content = record.content_stream().read(max_payload_bytes + 1)
+                        if len(tmp_content) > max_payload_bytes:
+                            if payload_overflow == "skip":
+                                reason_counts["Payload_Too_Large"] += 1
+                                tmp_content = None
+                                continue
+                            reason_counts["Payload_Truncated"] += 1
+                            tmp_content = tmp_content[:max_payload_bytes]
+                            payload_truncated = True
+                    else:
+                        tmp_content = record.content_stream().read()
 
-                # 「日本語が最も多くを占めるページ」ではない場合スキップ
-                languages = metadata["languages-cld2"]["languages"]
-                max_lang_code = max(languages, key=lambda x: x['text-covered'])['code']
-                if max_lang_code != "ja":
-                    continue
+                elif record.rec_type == 'metadata':
+                    if tmp_content is None:
+                        continue
 
-                lang_fast_text = None
-                if use_fast_text:
-                    lang_fast_text = lang_detect(tmp_content, metadata_parser, lang_predictor)
+                    # メタデータのパース
+                    metadata = parse_metadata(record.content_stream().read())
 
-                    # FastTextを使用している場合、日本語が検出されなかったらスキップ
-                    if lang_fast_text is None or lang_fast_text[0][0] != "ja":
+                    # cld2の解析が失敗 or languagesが存在しない場合スキップ
+                    if "languages-cld2" not in metadata or "languages" not in metadata["languages-cld2"]:
                         continue
 
-                if enable_text_extraction_from_html:
-                    try:
-                        # 本文の抽出にはtrafilaturaを用いる。（抽出精度が高いため）
-                        # include_formatting=Trueにすることで、抽出したテキストがMarkdown形式になる（h2タグが見出しになったり、テーブルがパースされたり）
-                        # deduplicateの効果は不明
-                        with timeout(trafilatura_timeout, timer="thread"):
-                            json_data = extract_data(tmp_content)
-                        result = json.loads(json_data)
-                    except:
+                    # 「日本語が最も多くを占めるページ」ではない場合スキップ
+                    languages = metadata["languages-cld2"]["languages"]
+                    max_lang_code = max(languages, key=lambda x: x['text-covered'])['code']
+                    if max_lang_code != "ja":
                         continue
 
-                    # （Swallowより）本文の文字数が400以下の場合は低品質とみなす（ただしスキップはしない）
-                    if len(result["text"]) < 400:
-                        result["rejected"] = True
-                        result["rejected_reason"] = "Too_Short"
+                    lang_fast_text = None
+                    if use_fast_text:
+                        # <head>のmeta/titleを見るだけなので、先頭部分だけを正規表現にかける
+                        lang_detect_content = tmp_content[:lang_detect_prefix_bytes] if lang_detect_prefix_bytes > 0 else tmp_content
+                        lang_fast_text = lang_detect(lang_detect_content, metadata_parser, lang_predictor)
+                        del lang_detect_content
+
+                        # FastTextを使用している場合、日本語が検出されなかったらスキップ
+                        if lang_fast_text is None or lang_fast_text[0][0] != "ja":
+                            continue
+
+                    if enable_text_extraction_from_html:
+                        try:
+                            # 本文の抽出にはtrafilaturaを用いる。（抽出精度が高いため）
+                            # include_formatting=Trueにすることで、抽出したテキストがMarkdown形式になる（h2タグが見出しになったり、テーブルがパースされたり）
+                            # deduplicateの効果は不明
+                            with timeout(trafilatura_timeout, timer="thread"):
+                                json_data = extract_data(tmp_content)
+                            result = json.loads(json_data)
+                        except:
+                            continue
+
+                        # （Swallowより）本文の文字数が400以下の場合は低品質とみなす（ただしスキップはしない）
+                        # 品質シグナルを使う場合はwarcファイルを読み終えてからまとめて判定する
+                        if quality_thresholds is None:
+                            if len(result["text"]) < 400:
+                                result["rejected"] = True
+                                result["rejected_reason"] = "Too_Short"
+                            else:
+                                result["rejected"] = False
+                                result["rejected_reason"] = ""
+
+                        result["languages-fasttext"] = lang_fast_text[0] if lang_fast_text else None
                     else:
-                        result["rejected"] = False
-                        result["rejected_reason"] = ""
+                        result = {"raw_data": base64.b64encode(tmp_content).decode('utf-8'), "encoding": "base64"}
 
-                    result["languages-fasttext"] = lang_fast_text[0] if lang_fast_text else None
-                else:
-                    result = {"raw_data": base64.b64encode(tmp_content).decode('utf-8'), "encoding": "base64"}
+                    result["rec_headers"] = dict(record.rec_headers.headers)
+                    result["metadata"] = metadata
+                    result["warc_path"] = warc_path
+                    # 切り詰めたhtmlかどうかを後段で区別できるようにする
+                    result["payload_truncated"] = payload_truncated
 
-                result["rec_headers"] = dict(record.rec_headers.headers)
-                result["metadata"] = metadata
-                result["warc_path"] = warc_path
+                    result_list.append(result)
+                    tmp_content = None
+        finally:
+            stream.close()
 
-                result_list.append(result)
-                tmp_content = None
+        if enable_text_extraction_from_html and quality_thresholds is not None:
+            QualityFilter(quality_thresholds).apply(result_list)
 
-        return True, warc_path, result_list
+        return True, warc_path, result_list, reason_counts, get_task_stats()
     except Exception as e:
         traceback.print_exc()
         if process_max_trial > 0 and current_trial > process_max_trial:
-            return False, warc_path, result_list
+            return False, warc_path, result_list, reason_counts, get_task_stats()
         print(f"{warc_path} restart the process.")
         del lang_predictor
 
@@ -220,7 +295,15 @@ def process_warc(warc_path, use_fast_text=True, trafilatura_timeout=30, current_
             trafilatura_timeout=trafilatura_timeout,
             current_trial=current_trial+1,
             process_max_trial=process_max_trial,
-            enable_text_extraction_from_html=enable_text_extraction_from_html
+            dl_max_trial=dl_max_trial,
+            enable_text_extraction_from_html=enable_text_extraction_from_html,
+            decompression_threads=decompression_threads,
+            decompression_chunk_size=decompression_chunk_size,
+            max_payload_bytes=max_payload_bytes,
+            payload_overflow=payload_overflow,
+            lang_detect_prefix_bytes=lang_detect_prefix_bytes,
+            quality_thresholds=quality_thresholds,
+            prefilter_config=prefilter_config
         )
 
 
@@ -235,15 +318,8 @@ def signal_handler(sig, frame):
     """
     print('Ctrl+C pressed. Shutting down gracefully...')
 
-    if get_file_size(temp_file_path) > 0:
-        compress(temp_file_path, output_folder_path)
-
-    clear_tmp_file(temp_file_path, create_empty=False)
-
-    # 進捗データの保存
-    progression = {"processed_file_names": processed_file_names}
-    with open(os.path.join(working_dir, "progress_parallel.txt"), "w", encoding="utf-8") as f:
-        json.dump(progression, f, ensure_ascii=False)
+    for job in snapshot_jobs:
+        job.flush(zstd_frame_records, write_shard_stats_enabled, create_empty=False)
 
     print("Progression saved.")
 
@@ -284,18 +360,96 @@ def clear_tmp_file(path, create_empty=True):
         traceback.print_exc()
 
 
-def compress(src_path, output_folder_path):
+def compress(src_path, output_folder_path, frame_records=0, write_stats=False, dataset_dir=None):
+    """
+    一時ファイルをzstd圧縮してulidで命名したシャードとして保存する
+    :param src_path: 一時ファイル（JSONL）
+    :param output_folder_path: シャードの保存先フォルダ
+    :param frame_records: 0より大きい場合、この件数ごとに独立したフレームで書き込み（seekable format）、
+                          レコード番号・WARC-Record-ID・URLからフレームを引けるインデックスを書き出す
+    :param write_stats: Trueの場合、書き込みながら文書の統計を集計して`<シャード名>.stats.json`に書き出し、
+                        output_folder_path全体のロールアップも更新する
+    :param dataset_dir: output_folder_pathがdataset_dirのサブフォルダ（スナップショットごとの出力先）の場合に指定する。
+                        dataset_dir以下の全シャードのロールアップも更新する
+    """
     print("compressing and writing shards.")
     os.makedirs(output_folder_path, exist_ok=True)
     output_file_name = os.path.join(output_folder_path, str(ULID()) + ".zst")
+    stats = ShardStats() if write_stats else None
     with open(src_path, "r", encoding="utf-8") as src_f, open(output_file_name, "wb") as out_f:
-        cctx = zstandard.ZstdCompressor()
-        with cctx.stream_writer(out_f) as compressor:
+        if frame_records > 0:
+            writer = SeekableZstdWriter(out_f, frame_records=frame_records)
             for line in src_f:
-                compressor.write(line.encode("utf-8"))
-            compressor.flush()
+                record = json.loads(line)
+                if stats is not None:
+                    stats.add(record)
+                rec_headers = record.get("rec_headers", {})
+                writer.write(line.encode("utf-8"), rec_headers.get("WARC-Record-ID"), rec_headers.get("WARC-Target-URI"))
+            write_index(writer.close(), output_file_name)
+        else:
+            cctx = zstandard.ZstdCompressor()
+            with cctx.stream_writer(out_f) as compressor:
+                for line in src_f:
+                    if stats is not None:
+                        stats.add(json.loads(line))
+                    compressor.write(line.encode("utf-8"))
+                compressor.flush()
     print("Compressed and saved to", output_file_name)
 
+    if stats is not None:
+        write_shard_stats(stats, output_file_name)
+        write_rollup(output_folder_path)
+        if dataset_dir is not None and os.path.abspath(dataset_dir) != os.path.abspath(output_folder_path):
+            write_rollup(dataset_dir)
+
+
+class SnapshotJob:
+    """1つのスナップショットの処理状態（出力先、一時ファイル、進捗）"""
+
+    def __init__(self, name, warc_paths_url, output_folder_path, temp_file_path, progress_path, dataset_dir=None):
+        """
+        :param name: スナップショット名（例: CC-MAIN-2024-18）
+        :param warc_paths_url: warc.paths.gzのURL
+        :param output_folder_path: シャードの保存先フォルダ
+        :param temp_file_path: 一時ファイル
+        :param progress_path: 進捗ファイル
+        :param dataset_dir: データセット全体の保存先。output_folder_pathと異なる場合、全体のロールアップも更新する
+        """
+        self.name = name
+        self.warc_paths_url = warc_paths_url
+        self.output_folder_path = output_folder_path
+        self.temp_file_path = temp_file_path
+        self.progress_path = progress_path
+        self.dataset_dir = dataset_dir
+        self.num_finished = 0
+        self.processed_file_names = self.load_progress()
+
+    def load_progress(self):
+        """
+        進捗データは処理済みセグメントファイル名の配列
+        もし進捗ファイルが読み込めない場合は新しく作成する
+        """
+        try:
+            with open(self.progress_path, "r", encoding="utf-8") as f:
+                obj = json.loads(f.read())
+                return obj["processed_file_names"]
+        except Exception as e:
+            print(e)
+            print(f"{self.name}: Create New.")
+            return []
+
+    def save_progress(self):
+        progression = {"processed_file_names": self.processed_file_names}
+        with open(self.progress_path, "w", encoding="utf-8") as f:
+            json.dump(progression, f, ensure_ascii=False)
+
+    def flush(self, frame_records=0, write_stats=False, create_empty=True):
+        """一時ファイルをシャードとして保存し、進捗を保存する"""
+        if get_file_size(self.temp_file_path) > 0:
+            compress(self.temp_file_path, self.output_folder_path, frame_records, write_stats, self.dataset_dir)
+        clear_tmp_file(self.temp_file_path, create_empty=create_empty)
+        self.save_progress()
+
 
 if __name__ == '__main__':
     freeze_support()
@@ -311,106 +465,199 @@ if __name__ == '__main__':
     working_dir = config.get('working_dir')
     output_folder_path = config.get('dataset_dir')
     num_proc = config.get('num_proc')
+    autoscale_workers = config.get('autoscale_workers')
+    min_proc = config.get('min_proc') or 1
+    max_proc = (config.get('max_proc') or num_proc) if autoscale_workers else num_proc
+    autoscale_interval = config.get('autoscale_interval') or 300
+    autoscale_min_memory_ratio = config.get('autoscale_min_memory_ratio') or 0.15
     zstd_chunk_size = config.get('num_zstd_chunk_size')
+    zstd_frame_records = config.get('zstd_frame_records') or 0
+    write_shard_stats_enabled = config.get('write_shard_stats')
     temp_file_path = config.get('temp_file_path')
     warc_paths_url = config.get('warc_paths_url')
+    snapshots = config.get('snapshots')
+    manifest_cache_dir = config.get('manifest_cache_dir') or os.path.join(working_dir, "manifests")
     use_fast_text = config.get('fast_text_language_recognition')
     trafilatura_timeout = config.get('trafilatura_timeout')
     enable_text_extraction_from_html = config.get('enable_text_extraction_from_html')
     dl_max_trial = config.get('download_max_trial')
     warc_max_trial = config.get('process_warc_max_trial')
+    decompression_threads = config.get('decompression_threads') or 0
+    decompression_chunk_size = (config.get('decompression_chunk_size_mb') or 8) * 1024 * 1024
+    max_payload_bytes = config.get('max_payload_bytes') or 0
+    payload_overflow = config.get('payload_overflow') or 'truncate'
+    lang_detect_prefix_bytes = config.get('lang_detect_prefix_bytes') or 0
+    quality_thresholds = (config.get('quality_thresholds') or {}) if config.get('enable_quality_filter') else None
+    prefilter_config = {
+        "mime_types": config.get('prefilter_mime_types') or ["text/html"],
+        "min_content_length": config.get('prefilter_min_content_length'),
+        "max_content_length": config.get('prefilter_max_content_length'),
+        "allow_hosts": config.get('prefilter_allow_hosts'),
+        "deny_hosts": config.get('prefilter_deny_hosts'),
+        "spam_domain_files": config.get('prefilter_spam_domain_files'),
+        "url_deny_patterns": config.get('prefilter_url_deny_patterns'),
+    }
+    profile_sample_rate = config.get('profile_sample_rate') or 0
+    profile_top_n = config.get('profile_top_n') or 50
+    profile_dir = os.path.join(working_dir, "profiles")
+    profile_report_path = os.path.join(working_dir, "profile_report.txt")
+    warc_index_path = config.get('warc_index_path')
+    warc_index_language = config.get('warc_index_language') or 'jpn'
+    warc_min_predicted_yield = config.get('warc_min_predicted_yield') or 0
+    warc_max_count = config.get('warc_max_count')
 
     # 実行時引数の値をprintで出力
     print(f"Working directory: {working_dir}")
     print(f"Dataset directory: {output_folder_path}")
     print("Note: If you are using Docker, these paths are within the container where this program is running :)")
+    print(f"Snapshots: {snapshots if snapshots else warc_paths_url}")
     print(f"Number of processes: {num_proc}")
+    if autoscale_workers:
+        print(f"\tAutoscale between {min_proc} and {max_proc} every {autoscale_interval} secs")
     print(f"Number of ZSTD chunk size: {zstd_chunk_size}")
+    print(f"Records per seekable ZSTD frame: {zstd_frame_records}")
+    print(f"Write shard statistics: {write_shard_stats_enabled}")
     print(f"Use fast text for language recognition: {use_fast_text}")
     print(f"Trafilatura text extracting: {enable_text_extraction_from_html}")
     print(f"\tTimeout after: {trafilatura_timeout} secs")
+    print(f"\tQuality filter: {quality_thresholds is not None}")
     print(f"Max trials:\n\tDownload: {dl_max_trial}\n\tWarc Processing: {warc_max_trial}")
+    print(f"Decompression threads per WARC: {decompression_threads}")
+    print(f"Max HTML payload bytes: {max_payload_bytes} ({payload_overflow})")
+    print(f"Pre-filter: {prefilter_config}")
+    print(f"WARC index for yield prediction: {warc_index_path}")
+    print(f"Profile sample rate: {profile_sample_rate}")
 
     # trafilaturaによるwarningを抑制
     logging.getLogger("trafilatura.utils").setLevel(logging.ERROR)
     logging.getLogger("trafilatura.core").setLevel(logging.ERROR)
 
     # 前回実行時、処理が途中で中断された場合にデータセットと進捗を復元する
-    # 1. warc.pathsファイルの読み込み
+    # 1. warc.pathsファイルの読み込み（キャッシュがあればETagで更新を確認する）
     # 2. 進捗の読み込み
+    # snapshotsが指定されていれば、スナップショットごとに出力先・一時ファイル・進捗を分ける
+    if snapshots:
+        temp_file_root, temp_file_ext = os.path.splitext(temp_file_path)
+        snapshot_jobs = [
+            SnapshotJob(
+                name=snapshot,
+                warc_paths_url=snapshot_warc_paths_url(snapshot),
+                output_folder_path=os.path.join(output_folder_path, snapshot),
+                temp_file_path=f"{temp_file_root}.{snapshot}{temp_file_ext}",
+                progress_path=os.path.join(working_dir, f"progress_parallel_{snapshot}.txt"),
+                dataset_dir=output_folder_path,
+            )
+            for snapshot in snapshots
+        ]
+    else:
+        snapshot_jobs = [
+            SnapshotJob(
+                name=os.path.basename(os.path.dirname(warc_paths_url)),
+                warc_paths_url=warc_paths_url,
+                output_folder_path=output_folder_path,
+                temp_file_path=temp_file_path,
+                progress_path=os.path.join(working_dir, "progress_parallel.txt"),
+            )
+        ]
+
+    # インデックスが指定されていれば、予想レコード数の多いwarcファイルから処理する
+    warc_yields = load_warc_yields(warc_index_path, warc_index_language) if warc_index_path else None
+
+    # 全スナップショットの未処理のwarcファイルを1つのキューにまとめる
+    # スナップショットの切り替わりでプールが空にならないように、同じスケジューラで処理する
+    cleaned_warcs = []
+    warc_jobs = {}
+    for job in snapshot_jobs:
+        warc_paths = fetch_warc_paths(job.warc_paths_url, manifest_cache_dir)
 
-    # warc.pathsファイルの読み込み
-    # gzipファイルのダウンロード
-    gzip_file_path = "./warc.paths.gz"
-    response = requests.get(warc_paths_url)
-    with open(gzip_file_path, "wb") as f:
-        f.write(response.content)
-
-    # gzipファイルの展開
-    extracted_file_path = "./warc.paths"
-    with gzip.open(gzip_file_path, 'rb') as f_in:
-        with open(extracted_file_path, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-
-    # 展開したファイルの読み込み
-    with open(extracted_file_path, "r", encoding="utf-8") as f:
-        warc_paths = f.read().splitlines()
-
-    # ダウンロードしたgzipファイルの削除（オプション）
-    os.remove(gzip_file_path)
-    os.remove(extracted_file_path)
-
-    # 進捗の読み込み
-    # 進捗データは処理済みセグメントファイル名の配列
-    # もし進捗ファイルが読み込めない場合は新しく作成する
-    try:
-        with open(os.path.join(working_dir, "progress_parallel.txt"), "r", encoding="utf-8") as f:
-            obj = json.loads(f.read())
-            processed_file_names = obj["processed_file_names"]
-    except Exception as e:
-        print(e)
-        print("Create New.")
-        processed_file_names = []
+        # 処理していないセグメントファイル名の一覧を取得
+        processed = set(job.processed_file_names)
+        job_warcs = [warc_path for warc_path in warc_paths if warc_path not in processed]
+        print(f"{job.name}: {len(job_warcs)} / {len(warc_paths)} WARCs remaining")
 
-    # 処理していないセグメントファイル名の一覧を取得
-    cleaned_warcs = []
-    for warc_path in warc_paths:
-        if warc_path not in processed_file_names:
+        for warc_path in job_warcs:
+            warc_jobs[warc_path] = job
             cleaned_warcs.append(warc_path)
 
+    # 予想レコード数による並べ替えと上限は、全スナップショットをまとめた上で適用する
+    # （予想レコード数が同じならスナップショットの順番が保たれる）
+    if warc_yields is not None:
+        num_cleaned_warcs = len(cleaned_warcs)
+        cleaned_warcs = plan_warcs(cleaned_warcs, warc_yields, warc_min_predicted_yield, warc_max_count)
+        print(f"Planned {len(cleaned_warcs)} / {num_cleaned_warcs} WARCs, "
+              f"expected records: {sum(warc_yields.get(path, 0) for path in cleaned_warcs)}")
+        for job in snapshot_jobs:
+            print(f"\t{job.name}: {sum(1 for path in cleaned_warcs if warc_jobs[path] is job)} WARCs")
+
+    queued_warcs = deque(cleaned_warcs)
+
     try:
         # 進捗バー表示のための全体のデータ数
-        total_iterations = len(cleaned_warcs)
+        total_iterations = len(queued_warcs)
+        # 切り詰め・スキップしたレコード数の合計
+        reason_counts = Counter()
+        # 同時に処理するwarcファイル数の調整。無効な場合はnum_procで固定
+        if autoscale_workers:
+            autoscaler = WorkerAutoscaler(min_proc, max_proc, initial_workers=num_proc, interval=autoscale_interval,
+                                          min_memory_available_ratio=autoscale_min_memory_ratio)
+        else:
+            autoscaler = WorkerAutoscaler(num_proc, num_proc, interval=autoscale_interval)
         # 一時ファイルの初期化
-        clear_tmp_file(temp_file_path)
+        for job in snapshot_jobs:
+            clear_tmp_file(job.temp_file_path)
         # 並列処理の実行
         with tqdm(total=total_iterations, unit='file', unit_scale=True) as pbar:
-            with ProcessPoolExecutor(max_workers=num_proc) as executor:
+            with ProcessPoolExecutor(max_workers=max_proc) as executor:
                 # InterruptとTerminateのハンドラを設定
                 signal.signal(signal.SIGINT, signal_handler)
                 signal.signal(signal.SIGTERM, signal_handler)
                 try:
                     def on_process_finished(future):
                         pbar.update(1)
-                        result = future.result()  # ここでのresultは(bool, str, list[dict])
+                        result = future.result()  # ここでのresultは(bool, str, list[dict], Counter, dict)
+                        job = warc_jobs[result[1]]
+                        job.num_finished += 1
+                        # 切り詰め・スキップしたレコード数を進捗バーに表示
+                        reason_counts.update(result[3])
+                        if reason_counts:
+                            pbar.set_postfix(reason_counts)
                         if result[0]:
                             # 一時ファイルに保存
-                            save_refined(result[2], temp_file_path)
+                            save_refined(result[2], job.temp_file_path)
                             # 処理済みファイル名を追加
-                            processed_file_names.append(result[1])
-                            # もし処理したファイル数がchunk sizeになったらzstd圧縮して保存
-                            if pbar.n % zstd_chunk_size == 0:
-                                compress(temp_file_path, output_folder_path)
-                                # 進捗データの保存
-                                progression = {"processed_file_names": processed_file_names}
-                                with open(os.path.join(working_dir, "progress_parallel.txt"), "w",
-                                          encoding="utf-8") as f:
-                                    json.dump(progression, f, ensure_ascii=False)
-                                clear_tmp_file(temp_file_path)
-
-                    for warc_path in cleaned_warcs:
-                        future = executor.submit(process_warc, warc_path, use_fast_text, trafilatura_timeout, 0, warc_max_trial, dl_max_trial, enable_text_extraction_from_html)
-                        future.add_done_callback(on_process_finished)
+                            job.processed_file_names.append(result[1])
+                            # もしこのスナップショットで処理したファイル数がchunk sizeになったらzstd圧縮して保存
+                            if job.num_finished % zstd_chunk_size == 0:
+                                job.flush(zstd_frame_records, write_shard_stats_enabled)
+
+                                # プロファイルのレポートを更新
+                                if profile_sample_rate > 0:
+                                    write_profile_report(profile_dir, profile_report_path, profile_top_n)
+
+                    # autoscaler.targetの数だけwarcファイルを同時に処理する
+                    running_futures = set()
+                    while queued_warcs or running_futures:
+                        while queued_warcs and len(running_futures) < autoscaler.target:
+                            warc_path = queued_warcs.popleft()
+                            process_args = (warc_path, use_fast_text, trafilatura_timeout, 0, warc_max_trial, dl_max_trial, enable_text_extraction_from_html,
+                                            decompression_threads, decompression_chunk_size,
+                                            max_payload_bytes, payload_overflow, lang_detect_prefix_bytes,
+                                            quality_thresholds, prefilter_config)
+                            if profile_sample_rate > 0:
+                                # 一部のwarcファイルの処理だけをcProfileで計測する
+                                future = executor.submit(run_with_profile, profile_sample_rate, profile_dir, os.path.basename(warc_path),
+                                                         process_warc, *process_args)
+                            else:
+                                future = executor.submit(process_warc, *process_args)
+                            future.add_done_callback(on_process_finished)
+                            running_futures.add(future)
+
+                        done_futures, running_futures = concurrent.futures.wait(
+                            running_futures, timeout=autoscale_interval, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in done_futures:
+                            if future.exception() is None:
+                                autoscaler.record(future.result()[4])
+                        autoscaler.update()
                 except:
                     traceback.print_exc()
 
@@ -418,12 +665,9 @@ if __name__ == '__main__':
         traceback.print_exc()
     finally:
         print("finishing main roop...")
-        if get_file_size(temp_file_path) > 0:
-            compress(temp_file_path, output_folder_path)
-
-            clear_tmp_file(temp_file_path, create_empty=False)
+        for job in snapshot_jobs:
+            job.flush(zstd_frame_records, write_shard_stats_enabled, create_empty=False)
 
-            # 進捗データの保存
-            progression = {"processed_file_names": processed_file_names}
-            with open(os.path.join(working_dir, "progress_parallel.txt"), "w", encoding="utf-8") as f:
-                json.dump(progression, f, ensure_ascii=False)
+        if profile_sample_rate > 0:
+            num_profiles = write_profile_report(profile_dir, profile_report_path, profile_top_n)
+            print(f"Profile report of {num_profiles} WARCs saved to {profile_report_path}")
@@ -0,0 +1,166 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    # ISA-Lがインストールされていればそちらを使う（stdlibのzlibより数倍速い）
+    from isal import isal_zlib as zlib_backend
+except ImportError:
+    import zlib as zlib_backend
+
+GZIP_MAGIC = b'\x1f\x8b\x08'
+GZIP_WBITS = 31
+# inflate_membersで1回に解凍器へ渡すバイト数の範囲
+MIN_FEED_SIZE = 1024
+MAX_FEED_SIZE = 1024 * 1024
+
+
+def inflate_members(data):
+    """
+    gzipメンバーが連続したバイト列を解凍する。
+    dataは必ずメンバーの先頭から始まっている必要があるが、末尾は途中で切れていてもよい。
+
+    :param data: 圧縮済みのバイト列
+    :return: (decompressed, consumed)
+    decompressed: bytes - 完全に解凍できたメンバーの中身
+    consumed: int - 完全に解凍できたメンバーの合計バイト数。len(data)と異なる場合、残りは次のチャンクに持ち越す
+    """
+    outputs = []
+    consumed = 0
+    view = memoryview(data)
+    while consumed < len(data):
+        d = zlib_backend.decompressobj(GZIP_WBITS)
+        # 残り全部を渡すとメンバーの終わり以降がunused_dataにコピーされて、チャンク全体でO(メンバー数×チャンクサイズ)になる。
+        # 小さいサイズから倍々に区切って渡し、unused_dataが高々メンバーのサイズ程度に収まるようにする
+        member_outputs = []
+        pos = consumed
+        feed_size = MIN_FEED_SIZE
+        try:
+            while not d.eof and pos < len(data):
+                block = view[pos:pos + feed_size]
+                member_outputs.append(d.decompress(block))
+                pos += len(block)
+                feed_size = min(feed_size * 2, MAX_FEED_SIZE)
+        except zlib_backend.error:
+            # 偽の境界（圧縮データ中にたまたまマジックナンバーがあった）から始まっている
+            if consumed == 0:
+                raise
+            break
+        if not d.eof:
+            # メンバーが途中で切れている
+            break
+        outputs.extend(member_outputs)
+        consumed = pos - len(d.unused_data)
+    return b''.join(outputs), consumed
+
+
+class ParallelGzipReader(io.RawIOBase):
+    """
+    gzipメンバーが連続したストリーム（WARCは1レコード=1メンバー）をスレッドで並列に解凍するリーダー。
+    読み込んだ圧縮データをマジックナンバーの位置でチャンクに分割し、チャンクごとに並列解凍して順番通りに返す。
+    マジックナンバーは圧縮データ中にも偶然現れうるため、前のチャンクがちょうど境界で解凍し終わった場合のみ
+    次のチャンクの結果を採用し、そうでなければ持ち越したデータと結合して解凍し直す。
+    zlib（およびisal_zlib）は解凍中にGILを解放するので、スレッドで複数コアを使える。
+    """
+
+    def __init__(self, fileobj, num_threads=4, chunk_size=8 * 1024 * 1024, max_pending_bytes=None):
+        """
+        :param fileobj: 圧縮済みストリーム（response.rawなど）
+        :param num_threads: 解凍に使うスレッド数
+        :param chunk_size: 1チャンクあたりの圧縮データのおおよそのサイズ（バイト）
+        :param max_pending_bytes: 先読みする圧縮データの合計の上限（バイト）。Noneならnum_threads * chunk_size。
+            先読みしたチャンクは解凍結果と一緒に保持されるので、メモリ使用量はおおよそこの値×（1+圧縮率）になる
+        """
+        super().__init__()
+        self.fileobj = fileobj
+        self.num_threads = num_threads
+        self.chunk_size = chunk_size
+        self.executor = ThreadPoolExecutor(max_workers=num_threads)
+        # (圧縮データ, future)のキュー。チャンクの境界が見つからないとchunk_sizeより大きくなるので、チャンク数ではなくバイト数で制限する
+        self.pending = []
+        self.pending_bytes = 0
+        self.max_pending_bytes = max_pending_bytes or num_threads * chunk_size
+        self.read_buffer = b''
+        self.source_eof = False
+        self.carry = b''
+        self.output = b''
+        self.output_pos = 0
+
+    def readable(self):
+        return True
+
+    def _read_source(self, size):
+        # response.rawは要求したサイズより少なく返すことがあるので、埋まるまで読む
+        parts = []
+        remaining = size
+        while remaining > 0:
+            block = self.fileobj.read(remaining)
+            if not block:
+                self.source_eof = True
+                break
+            parts.append(block)
+            remaining -= len(block)
+        return b''.join(parts)
+
+    def _next_chunk(self):
+        """次に解凍するチャンク（メンバー境界の候補で区切られた圧縮データ）を返す。無ければNone"""
+        while not self.source_eof:
+            self.read_buffer += self._read_source(self.chunk_size)
+            # 最後に見つかった境界候補の手前までをチャンクにする
+            boundary = self.read_buffer.rfind(GZIP_MAGIC, 1)
+            if boundary > 0:
+                chunk, self.read_buffer = self.read_buffer[:boundary], self.read_buffer[boundary:]
+                return chunk
+        if self.read_buffer:
+            chunk, self.read_buffer = self.read_buffer, b''
+            return chunk
+        return None
+
+    def _fill_pending(self):
+        # 上限を超えていても、少なくとも1チャンクは先読みする
+        while not self.pending or self.pending_bytes < self.max_pending_bytes:
+            chunk = self._next_chunk()
+            if chunk is None:
+                break
+            self.pending.append((chunk, self.executor.submit(inflate_members, chunk)))
+            self.pending_bytes += len(chunk)
+
+    def _next_output(self):
+        """順番通りに次の解凍済みデータを返す。ストリームの終端ならb''"""
+        while True:
+            self._fill_pending()
+            if not self.pending:
+                if self.carry:
+                    raise EOFError("Compressed stream ended before the end-of-stream marker was reached")
+                return b''
+            chunk, future = self.pending.pop(0)
+            self.pending_bytes -= len(chunk)
+            if self.carry:
+                # 前のチャンクが境界で終わらなかったので、このチャンクの並列解凍の結果は使えない
+                future.cancel()
+                chunk = self.carry + chunk
+                decompressed, consumed = inflate_members(chunk)
+            else:
+                decompressed, consumed = future.result()
+            self.carry = chunk[consumed:]
+            if decompressed:
+                return decompressed
+
+    def readinto(self, b):
+        if self.output_pos >= len(self.output):
+            self.output = self._next_output()
+            self.output_pos = 0
+            if not self.output:
+                return 0
+        n = min(len(b), len(self.output) - self.output_pos)
+        b[:n] = self.output[self.output_pos:self.output_pos + n]
+        self.output_pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            for _, future in self.pending:
+                future.cancel()
+            self.pending = []
+            self.pending_bytes = 0
+            self.executor.shutdown(wait=False)
+        super().close()
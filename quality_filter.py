@@ -0,0 +1,186 @@
+import logging
+from collections import Counter
+
+import numpy as np
+
+# SwallowコーパスやFineWeb、Gopherのルールを参考にした閾値。Noneにするとそのルールは使わない
+DEFAULT_THRESHOLDS = {
+    "min_length": 400,
+    "min_hiragana_fraction": 0.2,
+    "max_katakana_fraction": 0.5,
+    "min_line_end_punctuation_ratio": 0.12,
+    "max_ellipsis_line_ratio": 0.2,
+    "max_duplicate_line_fraction": 0.3,
+    "max_duplicate_line_char_fraction": 0.2,
+    "max_top_2gram_char_fraction": 0.2,
+    "max_top_3gram_char_fraction": 0.18,
+    "max_top_4gram_char_fraction": 0.16,
+}
+
+# 文字種ごとのコードポイントの範囲（両端を含む）
+CHARACTER_CLASSES = {
+    "hiragana": [(0x3041, 0x309F)],
+    "katakana": [(0x30A0, 0x30FF), (0x31F0, 0x31FF), (0xFF66, 0xFF9F)],
+    "kanji": [(0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF)],
+    "ascii_alpha": [(0x41, 0x5A), (0x61, 0x7A)],
+    "digit": [(0x30, 0x39), (0xFF10, 0xFF19)],
+    "punctuation": [(0x21, 0x2F), (0x3A, 0x40), (0x5B, 0x60), (0x7B, 0x7E), (0x3001, 0x303F), (0xFF01, 0xFF0F),
+                    (0xFF1A, 0xFF20), (0xFF3B, 0xFF40), (0xFF5B, 0xFF65)],
+    "whitespace": [(0x09, 0x0D), (0x20, 0x20), (0x3000, 0x3000)],
+}
+LINE_END_PUNCTUATION = np.array([ord(c) for c in "。．.！!？?」』)）\"”"], dtype=np.uint32)
+NEWLINE = ord("\n")
+ELLIPSIS = ord("…")
+PERIOD = ord(".")
+
+# 判定の順番と、引っかかった場合のrejected_reason
+RULES = [
+    ("min_length", "length", "Too_Short"),
+    ("min_hiragana_fraction", "hiragana_fraction", "Low_Hiragana_Fraction"),
+    ("max_katakana_fraction", "katakana_fraction", "High_Katakana_Fraction"),
+    ("min_line_end_punctuation_ratio", "line_end_punctuation_ratio", "Low_Line_End_Punctuation"),
+    ("max_ellipsis_line_ratio", "ellipsis_line_ratio", "Ellipsis_Lines"),
+    ("max_duplicate_line_fraction", "duplicate_line_fraction", "Duplicate_Lines"),
+    ("max_duplicate_line_char_fraction", "duplicate_line_char_fraction", "Duplicate_Lines"),
+    ("max_top_2gram_char_fraction", "top_2gram_char_fraction", "Ngram_Repetition"),
+    ("max_top_3gram_char_fraction", "top_3gram_char_fraction", "Ngram_Repetition"),
+    ("max_top_4gram_char_fraction", "top_4gram_char_fraction", "Ngram_Repetition"),
+]
+
+
+def _in_ranges(codes, ranges):
+    mask = np.zeros(len(codes), dtype=bool)
+    for low, high in ranges:
+        mask |= (codes >= low) & (codes <= high)
+    return mask
+
+
+def _top_ngram_char_fraction(codes, n):
+    """最も多く出現する文字n-gramが占める文字の割合"""
+    if len(codes) < n:
+        return 0.0
+    # コードポイントは21bitに収まるので3-gramまでは64bitにそのまま詰められる。4-gram以上はハッシュで代用する
+    grams = codes[:len(codes) - n + 1].astype(np.uint64)
+    for i in range(1, n):
+        if i < 3:
+            grams = (grams << np.uint64(21)) | codes[i:len(codes) - n + 1 + i]
+        else:
+            grams = grams * np.uint64(0x100000001B3) ^ codes[i:len(codes) - n + 1 + i]
+    _, counts = np.unique(grams, return_counts=True)
+    return min(counts.max() * n / len(codes), 1.0)
+
+
+def _duplicate_line_fractions(text):
+    """重複した行の割合と、重複した行の文字数の割合"""
+    lines = [line for line in text.split("\n") if line.strip()]
+    if len(lines) == 0:
+        return 0.0, 0.0
+    counts = Counter(lines)
+    duplicate_lines = sum(count - 1 for count in counts.values())
+    duplicate_chars = sum(len(line) * (count - 1) for line, count in counts.items())
+    total_chars = sum(len(line) for line in lines)
+    return duplicate_lines / len(lines), duplicate_chars / total_chars if total_chars > 0 else 0.0
+
+
+def compute_quality_signals(texts):
+    """
+    複数の文書の品質シグナルをまとめて計算する。
+    全文書を1つのUTF-32の配列に連結し、文字種の判定や行末の判定をNumPyでまとめて行う。
+    :param texts: 文書のリスト
+    :return: {シグナル名: 文書ごとの値のndarray}
+    """
+    num_docs = len(texts)
+    lengths = np.array([len(text) for text in texts], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    # json.loadsは"\ud800"のような単独のサロゲートを含む文字列を返すことがあるので、そのままコードポイントにする
+    codes = np.frombuffer("".join(texts).encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32)
+    safe_lengths = np.maximum(lengths, 1)
+
+    def count_per_doc(mask):
+        cumulative = np.concatenate([[0], np.cumsum(mask, dtype=np.int64)])
+        return cumulative[ends] - cumulative[starts]
+
+    signals = {"length": lengths.astype(np.float64)}
+    for name, ranges in CHARACTER_CLASSES.items():
+        signals[name + "_fraction"] = count_per_doc(_in_ranges(codes, ranges)) / safe_lengths
+
+    # 行末の文字を調べる。行の終わりは改行の位置と文書の終わり
+    newline_positions = np.flatnonzero(codes == NEWLINE)
+    line_ends = np.concatenate([newline_positions, ends])
+    line_doc_ids = np.concatenate([np.searchsorted(ends, newline_positions, side="right"), np.arange(num_docs)])
+    line_starts = starts[line_doc_ids]
+    last = line_ends - 1
+    # 空行（文書の先頭や改行の直後で終わる行）は数えない
+    valid = last >= line_starts
+    if len(codes) > 0:
+        valid &= codes[np.maximum(last, 0)] != NEWLINE
+    last, line_doc_ids, line_starts = last[valid], line_doc_ids[valid], line_starts[valid]
+    last_chars = codes[last]
+
+    num_lines = np.bincount(line_doc_ids, minlength=num_docs)
+    safe_num_lines = np.maximum(num_lines, 1)
+    punctuation_lines = np.bincount(line_doc_ids, weights=np.isin(last_chars, LINE_END_PUNCTUATION), minlength=num_docs)
+    three_periods = (last - 2 >= line_starts) & (last_chars == PERIOD) & \
+        (codes[np.maximum(last - 1, 0)] == PERIOD) & (codes[np.maximum(last - 2, 0)] == PERIOD)
+    ellipsis_lines = np.bincount(line_doc_ids, weights=(last_chars == ELLIPSIS) | three_periods, minlength=num_docs)
+    signals["line_end_punctuation_ratio"] = punctuation_lines / safe_num_lines
+    signals["ellipsis_line_ratio"] = ellipsis_lines / safe_num_lines
+
+    # 重複行とn-gramの繰り返しは文書ごとに計算する（n-gramは文書内でベクトル化）
+    duplicate_lines = np.array([_duplicate_line_fractions(text) for text in texts], dtype=np.float64).reshape(num_docs, 2)
+    signals["duplicate_line_fraction"] = duplicate_lines[:, 0]
+    signals["duplicate_line_char_fraction"] = duplicate_lines[:, 1]
+    for n in (2, 3, 4):
+        signals[f"top_{n}gram_char_fraction"] = np.array(
+            [_top_ngram_char_fraction(codes[start:end], n) for start, end in zip(starts, ends)], dtype=np.float64)
+    return signals
+
+
+class QualityFilter:
+    """trafilaturaで抽出した文書に品質シグナルを付与し、閾値に従ってrejected/rejected_reasonを設定する"""
+
+    def __init__(self, thresholds=None):
+        """
+        :param thresholds: DEFAULT_THRESHOLDSを上書きする閾値
+        """
+        self.thresholds = dict(DEFAULT_THRESHOLDS)
+        if thresholds:
+            self.thresholds.update(thresholds)
+
+    def apply(self, results):
+        """
+        :param results: trafilaturaの出力（"text"を含むdict）のリスト。その場で書き換える
+        """
+        if len(results) == 0:
+            return
+        try:
+            self._apply_batch(results)
+        except Exception:
+            # バッチでの計算に失敗したら1文書ずつ計算し直し、失敗した文書だけをrejectedにする
+            logging.warning("Failed to compute quality signals for a batch. Retrying per document.", exc_info=True)
+            for result in results:
+                try:
+                    self._apply_batch([result])
+                except Exception:
+                    logging.warning("Failed to compute quality signals for a document.", exc_info=True)
+                    result["rejected"] = True
+                    result["rejected_reason"] = "Quality_Signal_Error"
+
+    def _apply_batch(self, results):
+        signals = compute_quality_signals([result["text"] or "" for result in results])
+
+        # 閾値ごとに全文書をまとめて判定し、最初に引っかかったルールを理由にする
+        reasons = np.full(len(results), "", dtype=object)
+        for key, signal_name, reason in RULES:
+            threshold = self.thresholds.get(key)
+            if threshold is None:
+                continue
+            values = signals[signal_name]
+            failed = values < threshold if key.startswith("min_") else values > threshold
+            reasons[(reasons == "") & failed] = reason
+
+        for i, result in enumerate(results):
+            result["rejected"] = reasons[i] != ""
+            result["rejected_reason"] = reasons[i]
+            result["quality_signals"] = {name: round(float(values[i]), 4) for name, values in signals.items()}
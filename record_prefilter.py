@@ -0,0 +1,125 @@
+import json
+import re
+from typing import Optional
+from urllib.parse import urlsplit
+
+# トライの終端を表すキー。ホスト名のラベルが空文字になることはない
+_END = ""
+
+
+def normalize_mime_type(content_type):
+    """`text/html; charset=UTF-8`のようなContent-Typeを`text/html`に正規化する"""
+    if not content_type:
+        return ""
+    return content_type.split(";", 1)[0].strip().lower()
+
+
+class HostSuffixTrie:
+    """
+    ホスト名のサフィックス（TLDやドメイン）を、ラベルを逆順にしたトライで保持する。
+    `example.co.jp`を追加すると`example.co.jp`と`www.example.co.jp`にマッチする
+    """
+
+    def __init__(self, suffixes=()):
+        self.root = {}
+        for suffix in suffixes:
+            self.add(suffix)
+
+    def add(self, suffix):
+        labels = suffix.strip().strip(".").lower().split(".")
+        if labels == [""]:
+            return
+        node = self.root
+        for label in reversed(labels):
+            node = node.setdefault(label, {})
+        node[_END] = True
+
+    def match(self, host):
+        """hostがいずれかのサフィックスで終わっていればTrue"""
+        # addと同じように正規化する（`spam.jp.`のような末尾にドットが付いたFQDNも対象にする）
+        node = self.root
+        for label in reversed(host.strip().strip(".").lower().split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
+
+
+def load_domain_list(path):
+    """1行1ドメインのリストを読み込む。空行と#から始まる行は無視する"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [domain for domain in (line.strip() for line in f) if domain and not domain.startswith("#")]
+
+
+class RecordPreFilter:
+    """
+    WARCのresponseレコードを、本文を読み込む前にヘッダーとURLだけで判定するフィルタ
+    """
+
+    def __init__(self, mime_types=("text/html",), min_content_length=0, max_content_length=0,
+                 allow_hosts=None, deny_hosts=None, spam_domain_files=None, url_deny_patterns=None):
+        """
+        :param mime_types: 処理するMIMEタイプ（正規化後の値で比較する）
+        :param min_content_length: WARCレコードのContent-Lengthがこれ未満ならスキップ。0なら無制限
+        :param max_content_length: WARCレコードのContent-Lengthがこれを超えたらスキップ。0なら無制限
+        :param allow_hosts: 指定した場合、このTLD・ドメインのいずれかに該当するホストだけを処理する
+        :param deny_hosts: このTLD・ドメインに該当するホストはスキップ
+        :param spam_domain_files: 1行1ドメインのスパムドメインリストのファイル
+        :param url_deny_patterns: URLがいずれかの正規表現にマッチしたらスキップ
+        """
+        self.mime_types = set(normalize_mime_type(m) for m in (mime_types or ()))
+        self.min_content_length = min_content_length or 0
+        self.max_content_length = max_content_length or 0
+        self.allow_hosts = HostSuffixTrie(allow_hosts) if allow_hosts else None
+        self.deny_hosts = HostSuffixTrie(deny_hosts or ())
+        self.spam_domains = HostSuffixTrie()
+        for path in spam_domain_files or ():
+            for domain in load_domain_list(path):
+                self.spam_domains.add(domain)
+        self.url_deny_pattern = re.compile("|".join(f"(?:{p})" for p in url_deny_patterns)) if url_deny_patterns else None
+
+    def check(self, record) -> Optional[str]:
+        """
+        :param record: warcioのresponseレコード
+        :return: スキップする場合はその理由、処理する場合はNone
+        """
+        if self.mime_types:
+            content_type = record.http_headers.get_header('Content-Type') if record.http_headers else None
+            if normalize_mime_type(content_type) not in self.mime_types:
+                return "Mime_Type"
+
+        if self.min_content_length > 0 and record.length < self.min_content_length:
+            return "Content_Length_Too_Small"
+        if self.max_content_length > 0 and record.length > self.max_content_length:
+            return "Content_Length_Too_Large"
+
+        url = record.rec_headers.get_header('WARC-Target-URI') or ""
+        host = urlsplit(url).hostname or ""
+        if self.allow_hosts is not None and not self.allow_hosts.match(host):
+            return "Host_Not_Allowed"
+        if self.deny_hosts.match(host):
+            return "Host_Denied"
+        if self.spam_domains.match(host):
+            return "Spam_Domain"
+        if self.url_deny_pattern is not None and self.url_deny_pattern.search(url):
+            return "URL_Denied"
+        return None
+
+
+# プロセスごとに構築済みのRecordPreFilterを保持する。{設定のJSON: RecordPreFilter}
+_prefilter_cache = {}
+
+
+def get_record_prefilter(prefilter_config=None):
+    """
+    設定に対応するRecordPreFilterを返す。
+    スパムドメインリストの読み込みとトライの構築は重いので、同じプロセスでは設定ごとに1回だけ行う
+    :param prefilter_config: RecordPreFilterの引数
+    """
+    key = json.dumps(prefilter_config or {}, sort_keys=True)
+    if key not in _prefilter_cache:
+        _prefilter_cache.clear()
+        _prefilter_cache[key] = RecordPreFilter(**(prefilter_config or {}))
+    return _prefilter_cache[key]
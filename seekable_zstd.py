@@ -0,0 +1,101 @@
+import json
+import struct
+
+import zstandard
+
+# https://github.com/facebook/zstd/blob/dev/contrib/seekable_format/zstd_seekable_compression_format.md
+SKIPPABLE_FRAME_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+INDEX_SUFFIX = ".index.json"
+
+
+class SeekableZstdWriter:
+    """
+    N件ごとに独立したzstdフレームとして書き込むライター。
+    ファイル末尾にzstd seekable formatのシークテーブル（skippable frame）を書き込むので、
+    通常のzstdとしても、seekable format対応のツールからも読める。
+    さらにレコード番号・WARC-Record-ID・URLからフレームの位置を引けるインデックスをサイドカーとして書き出す。
+    """
+
+    def __init__(self, out_f, frame_records=1000, level=3):
+        """
+        :param out_f: 書き込み先のファイル（バイナリモード）
+        :param frame_records: 1フレームに含めるレコード数
+        :param level: zstdの圧縮レベル
+        """
+        self.out_f = out_f
+        self.frame_records = frame_records
+        self.cctx = zstandard.ZstdCompressor(level=level)
+        self.offset = 0
+        self.buffer = []
+        self.buffer_size = 0
+        self.frames = []
+        self.records = []
+
+    def write(self, line: bytes, record_id=None, url=None):
+        """1レコード（改行込みのJSONL1行）を書き込む"""
+        self.records.append({
+            "record": len(self.records),
+            "id": record_id,
+            "url": url,
+            "frame": len(self.frames),
+            "offset_in_frame": self.buffer_size,
+            "length": len(line),
+        })
+        self.buffer.append(line)
+        self.buffer_size += len(line)
+        if len(self.buffer) >= self.frame_records:
+            self.flush_frame()
+
+    def flush_frame(self):
+        if not self.buffer:
+            return
+        data = b''.join(self.buffer)
+        compressed = self.cctx.compress(data)
+        self.out_f.write(compressed)
+        self.frames.append({
+            "offset": self.offset,
+            "compressed_size": len(compressed),
+            "decompressed_size": len(data),
+            "first_record": self.records[-len(self.buffer)]["record"],
+            "num_records": len(self.buffer),
+        })
+        self.offset += len(compressed)
+        self.buffer = []
+        self.buffer_size = 0
+
+    def close(self):
+        """残りのレコードとシークテーブルを書き込み、インデックスを返す"""
+        self.flush_frame()
+        # シークテーブル: 各フレームの(圧縮後サイズ, 圧縮前サイズ) + フッター(フレーム数, 記述子, マジックナンバー)
+        entries = b''.join(struct.pack('<II', f["compressed_size"], f["decompressed_size"]) for f in self.frames)
+        footer = struct.pack('<IBI', len(self.frames), 0, SEEKABLE_MAGIC)
+        payload = entries + footer
+        self.out_f.write(struct.pack('<II', SKIPPABLE_FRAME_MAGIC, len(payload)) + payload)
+        return {"format": "zstd-seekable", "frames": self.frames, "records": self.records}
+
+
+def write_index(index, shard_path):
+    with open(shard_path + INDEX_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+
+
+def load_index(shard_path):
+    with open(shard_path + INDEX_SUFFIX, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_frame(shard_path, frame):
+    """インデックスのフレーム情報を元に、1フレームだけを読み込んで解凍する"""
+    with open(shard_path, "rb") as f:
+        f.seek(frame["offset"])
+        compressed = f.read(frame["compressed_size"])
+    return zstandard.ZstdDecompressor().decompress(compressed, max_output_size=frame["decompressed_size"])
+
+
+def read_record(shard_path, index, record_number):
+    """レコード番号を指定して1件だけ読み込む"""
+    entry = index["records"][record_number]
+    data = read_frame(shard_path, index["frames"][entry["frame"]])
+    start = entry["offset_in_frame"]
+    return json.loads(data[start:start + entry["length"]])
@@ -0,0 +1,119 @@
+import glob
+import json
+import os
+from collections import Counter
+from urllib.parse import urlsplit
+
+STATS_SUFFIX = ".stats.json"
+ROLLUP_FILE_NAME = "stats_rollup.json"
+NUM_SCORE_BINS = 10
+
+
+def _score_bin(score):
+    """0.0-1.0のスコアをNUM_SCORE_BINS個のビンに振り分ける"""
+    return str(min(int(score * NUM_SCORE_BINS), NUM_SCORE_BINS - 1) / NUM_SCORE_BINS)
+
+
+class ShardStats:
+    """シャードに含まれる文書の統計。compressで1行ずつ書き込みながら集計する"""
+
+    def __init__(self):
+        self.num_documents = 0
+        self.num_characters = 0
+        self.num_html_bytes = 0
+        self.rejected_reasons = Counter()
+        self.cld2_ja_score_histogram = Counter()
+        self.fasttext_score_histogram = Counter()
+        self.hostnames = Counter()
+        self.warc_paths = Counter()
+
+    def add(self, record):
+        """1文書（一時ファイルの1行をパースしたもの）を集計に加える"""
+        self.num_documents += 1
+        if "text" in record:
+            self.num_characters += len(record["text"] or "")
+        if "raw_data" in record:
+            # base64の長さから元のバイト数を求める
+            self.num_html_bytes += len(record["raw_data"]) * 3 // 4
+        if "rejected" in record:
+            self.rejected_reasons[record.get("rejected_reason") or "Accepted"] += 1
+
+        languages = record.get("metadata", {}).get("languages-cld2", {}).get("languages", [])
+        ja_score = next((lang["text-covered"] for lang in languages if lang.get("code") == "ja"), None)
+        if ja_score is not None:
+            self.cld2_ja_score_histogram[_score_bin(ja_score)] += 1
+        lang_fast_text = record.get("languages-fasttext")
+        if lang_fast_text:
+            self.fasttext_score_histogram[_score_bin(lang_fast_text[1])] += 1
+
+        hostname = record.get("hostname")
+        if not hostname:
+            hostname = urlsplit(record.get("rec_headers", {}).get("WARC-Target-URI", "")).hostname
+        if hostname:
+            self.hostnames[hostname] += 1
+        if "warc_path" in record:
+            self.warc_paths[record["warc_path"]] += 1
+
+    def merge(self, other):
+        self.num_documents += other.num_documents
+        self.num_characters += other.num_characters
+        self.num_html_bytes += other.num_html_bytes
+        self.rejected_reasons.update(other.rejected_reasons)
+        self.cld2_ja_score_histogram.update(other.cld2_ja_score_histogram)
+        self.fasttext_score_histogram.update(other.fasttext_score_histogram)
+        self.hostnames.update(other.hostnames)
+        self.warc_paths.update(other.warc_paths)
+
+    def to_dict(self, top_hostnames=1000):
+        """
+        JSONに書き出せる形に変換する
+        :param top_hostnames: 文書数の多い順にこの数のホスト名だけを残す（num_hostnamesは全体の数）
+        """
+        return {
+            "num_documents": self.num_documents,
+            "num_characters": self.num_characters,
+            "num_html_bytes": self.num_html_bytes,
+            "rejected_reasons": dict(self.rejected_reasons),
+            "cld2_ja_score_histogram": dict(sorted(self.cld2_ja_score_histogram.items())),
+            "fasttext_score_histogram": dict(sorted(self.fasttext_score_histogram.items())),
+            "num_hostnames": len(self.hostnames),
+            "hostnames": dict(self.hostnames.most_common(top_hostnames)),
+            "warc_paths": dict(self.warc_paths),
+        }
+
+    @classmethod
+    def from_dict(cls, obj):
+        stats = cls()
+        stats.num_documents = obj.get("num_documents", 0)
+        stats.num_characters = obj.get("num_characters", 0)
+        stats.num_html_bytes = obj.get("num_html_bytes", 0)
+        stats.rejected_reasons = Counter(obj.get("rejected_reasons", {}))
+        stats.cld2_ja_score_histogram = Counter(obj.get("cld2_ja_score_histogram", {}))
+        stats.fasttext_score_histogram = Counter(obj.get("fasttext_score_histogram", {}))
+        stats.hostnames = Counter(obj.get("hostnames", {}))
+        stats.warc_paths = Counter(obj.get("warc_paths", {}))
+        return stats
+
+
+def write_shard_stats(stats, shard_path):
+    with open(shard_path + STATS_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump(stats.to_dict(), f, ensure_ascii=False)
+
+
+def write_rollup(dataset_dir):
+    """
+    dataset_dir以下（サブフォルダを含む）の全てのシャードの統計を合計してstats_rollup.jsonに書き出す。
+    シャードごとの統計はホスト名を上位のみ残しているので、ロールアップのhostnamesは近似値
+    :return: ロールアップしたシャード数
+    """
+    rollup = ShardStats()
+    stats_paths = sorted(glob.glob(os.path.join(dataset_dir, "**", "*" + STATS_SUFFIX), recursive=True))
+    for stats_path in stats_paths:
+        with open(stats_path, "r", encoding="utf-8") as f:
+            rollup.merge(ShardStats.from_dict(json.load(f)))
+
+    obj = rollup.to_dict()
+    obj["num_shards"] = len(stats_paths)
+    with open(os.path.join(dataset_dir, ROLLUP_FILE_NAME), "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    return len(stats_paths)
@@ -0,0 +1,56 @@
+import cProfile
+import glob
+import io
+import os
+import pstats
+import random
+
+# レポートで個別に集計する関数（ホットパス）
+HOT_PATH_PATTERN = r'parse_metadata|lang_detect|xml_parser\.py|extract_data'
+
+
+def run_with_profile(sample_rate, profile_dir, profile_name, func, *args, **kwargs):
+    """
+    sample_rateの確率でfuncをcProfileで計測しながら実行する。
+    ProcessPoolExecutorのワーカー内で呼ばれるので、計測結果はファイルに書き出す。
+    :param sample_rate: 計測する確率（0.0-1.0）
+    :param profile_dir: 計測結果（.prof）の保存先フォルダ
+    :param profile_name: 計測結果のファイル名（拡張子なし）
+    :param func: 実行する関数
+    :return: funcの戻り値
+    """
+    if random.random() >= sample_rate:
+        return func(*args, **kwargs)
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir, profile_name + ".prof"))
+
+
+def write_profile_report(profile_dir, report_path, top_n=50):
+    """
+    profile_dir内の全ての計測結果を集計して、上位top_n件のレポートを書き出す
+    :return: 集計した計測結果の数
+    """
+    profile_paths = sorted(glob.glob(os.path.join(profile_dir, "*.prof")))
+    if len(profile_paths) == 0:
+        return 0
+
+    stream = io.StringIO()
+    stats = pstats.Stats(*profile_paths, stream=stream)
+    stream.write(f"Aggregated {len(profile_paths)} profiles\n\n")
+    stream.write("=== Top functions by cumulative time ===\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top_n)
+    stream.write("=== Top functions by internal time ===\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top_n)
+    stream.write("=== Hot path (parse_metadata, lang_detect, XMLMetadataParser, extract_data) ===\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(HOT_PATH_PATTERN)
+
+    with open(report_path, "w", encoding="utf-8") as f:
+        f.write(stream.getvalue())
+    return len(profile_paths)
@@ -0,0 +1,87 @@
+import gzip
+import json
+import os
+from collections import Counter
+from typing import Dict, List, Optional
+
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+
+def _is_target_record(languages, mime, status, target_language):
+    """インデックスの1行が「処理後に残りそうなレコード」かどうか"""
+    if status is not None and str(status) != "200":
+        return False
+    if mime is not None and mime != "text/html":
+        return False
+    if not languages:
+        return False
+    # content_languagesはcld2の判定結果を割合の大きい順にカンマ区切りで並べたもの
+    return languages.split(",", 1)[0] == target_language
+
+
+def load_parquet_index(index_path, target_language="jpn") -> Dict[str, int]:
+    """
+    Common Crawlのcolumnar index（Parquet）からwarcファイルごとの予想レコード数を集計する
+    :param index_path: Parquetファイル、またはParquetファイルが置かれたディレクトリ
+    :param target_language: ISO-639-3の言語コード
+    :return: {warc_filename: 予想レコード数}
+    """
+    dataset = ds.dataset(index_path, format="parquet")
+    columns = ["warc_filename", "content_languages", "content_mime_detected", "fetch_status"]
+    columns = [c for c in columns if c in dataset.schema.names]
+    # 必要なカラムだけ読み込み、条件に合う行をフィルタしてから集計する
+    expression = pc.field("content_languages").isin([target_language]) | \
+        pc.starts_with(pc.field("content_languages"), target_language + ",")
+    if "content_mime_detected" in columns:
+        expression &= pc.field("content_mime_detected") == "text/html"
+    if "fetch_status" in columns:
+        expression &= pc.field("fetch_status") == 200
+    table = dataset.to_table(columns=["warc_filename"], filter=expression)
+    counts = table.group_by("warc_filename").aggregate([("warc_filename", "count")])
+    return dict(zip(counts.column("warc_filename").to_pylist(), counts.column("warc_filename_count").to_pylist()))
+
+
+def load_cdx_index(index_path, target_language="jpn") -> Dict[str, int]:
+    """
+    Common Crawlのcdx index（`SURT timestamp JSON`形式、gzip圧縮可）からwarcファイルごとの予想レコード数を集計する
+    :param index_path: cdxファイル
+    :param target_language: ISO-639-3の言語コード
+    :return: {warc_filename: 予想レコード数}
+    """
+    counts = Counter()
+    opener = gzip.open if index_path.endswith(".gz") else open
+    with opener(index_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split(" ", 2)
+            if len(parts) < 3:
+                continue
+            entry = json.loads(parts[2])
+            if _is_target_record(entry.get("languages"), entry.get("mime-detected"), entry.get("status"), target_language):
+                counts[entry["filename"]] += 1
+    return dict(counts)
+
+
+def load_warc_yields(index_path, target_language="jpn") -> Dict[str, int]:
+    """インデックスの形式に応じて予想レコード数を読み込む"""
+    if os.path.isdir(index_path) or index_path.endswith(".parquet"):
+        return load_parquet_index(index_path, target_language)
+    return load_cdx_index(index_path, target_language)
+
+
+def plan_warcs(warc_paths: List[str], yields: Dict[str, int], min_yield=0, max_warcs: Optional[int] = None) -> List[str]:
+    """
+    予想レコード数が多い順にwarcファイルを並べ替える。
+    インデックスに含まれないwarcファイルは予想レコード数0として扱う。
+    :param warc_paths: 処理対象のwarcファイル
+    :param yields: load_warc_yieldsの戻り値
+    :param min_yield: 予想レコード数がこれ未満のwarcファイルは処理しない
+    :param max_warcs: 処理するwarcファイル数の上限。Noneなら無制限
+    :return: 処理する順に並べたwarcファイル
+    """
+    # sortedは安定ソートなので、予想レコード数が同じならwarc.pathsの順番が保たれる
+    planned = sorted(warc_paths, key=lambda path: yields.get(path, 0), reverse=True)
+    planned = [path for path in planned if yields.get(path, 0) >= min_yield]
+    if max_warcs is not None and max_warcs > 0:
+        planned = planned[:max_warcs]
+    return planned
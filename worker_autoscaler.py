@@ -0,0 +1,144 @@
+import os
+import time
+
+
+def read_memory_available_ratio():
+    """
+    /proc/meminfoから空きメモリの割合（MemAvailable / MemTotal）を読み込む
+    :return: 0.0-1.0。読み込めない環境ではNone
+    """
+    try:
+        meminfo = {}
+        with open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                meminfo[key] = int(value.split()[0])
+        return meminfo["MemAvailable"] / meminfo["MemTotal"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def read_load_ratio():
+    """1分間のロードアベレージをCPU数で割った値。1.0を超えるとCPUが飽和している"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return None
+
+
+class WorkerAutoscaler:
+    """
+    同時に処理するwarcファイル数（アクティブなワーカー数）をmin_workersとmax_workersの間で調整する。
+    一定間隔ごとに、終了したタスクのCPU時間/経過時間（ワーカーのビジー率）、ダウンロードスループット、
+    ロードアベレージ、空きメモリを見て1ずつ増減させる。
+    warcファイル（約1GB）のダウンロード量はタスクが終わったときにまとめて記録されるので、1回の間隔に終わるタスクは少なく
+    スループットのばらつきが大きい。そのため増やすかどうかはevaluation_intervals回分の間隔をまとめたスループットで判断する。
+    - 空きメモリがmin_memory_available_ratioを下回ったら減らす（間隔ごとに判断）
+    - CPUが飽和していたら減らす（間隔ごとに判断）
+    - CPUに余裕があり、空きメモリにも余裕があれば増やす。
+      ただしネットワーク待ちが主なとき（ビジー率が低いとき）に、前回増やしてもスループットがthroughput_marginを超えて
+      上がらなかった場合は、1つ戻してそのスループットを頭打ち（plateau）として記録する。
+      頭打ちの間は、ビジー率が上がるかスループットが頭打ちの値からthroughput_marginを超えて上がるまで増やさない
+    """
+
+    def __init__(self, min_workers, max_workers, initial_workers=None, interval=60,
+                 min_memory_available_ratio=0.15, busy_threshold=0.7, throughput_margin=0.05, evaluation_intervals=3):
+        """
+        :param min_workers: ワーカー数の下限
+        :param max_workers: ワーカー数の上限
+        :param initial_workers: 開始時のワーカー数。Noneならmin_workers
+        :param interval: 調整の間隔（秒）
+        :param min_memory_available_ratio: 空きメモリの割合がこれを下回ったらワーカーを減らす。増やすのはこの2倍以上空いているときだけ
+        :param busy_threshold: ワーカーのビジー率がこれ未満ならネットワーク律速とみなす
+        :param throughput_margin: スループットが上がったとみなす増加率。計測のばらつきで増減を繰り返さないようにする
+        :param evaluation_intervals: 増やすかどうかを判断するまでに、今のワーカー数でビジー率とスループットを計測する間隔の数
+        """
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target = max(min_workers, min(max_workers, initial_workers or min_workers))
+        self.interval = interval
+        self.min_memory_available_ratio = min_memory_available_ratio
+        self.busy_threshold = busy_threshold
+        self.throughput_margin = throughput_margin
+        self.evaluation_intervals = evaluation_intervals
+
+        self.last_update = time.time()
+        self.last_throughput = None
+        self.last_action = 0
+        # ネットワーク律速で頭打ちになったときのスループット。頭打ちでなければNone
+        self.plateau_throughput = None
+        self._reset_window()
+
+    def _reset_window(self):
+        # ワーカー数を変えたときか、増やすかどうかを判断したときに計測をやり直す
+        self.window_start = time.time()
+        self.window_intervals = 0
+        self.window_wall_time = 0.0
+        self.window_cpu_time = 0.0
+        self.window_download_bytes = 0
+        self.window_tasks = 0
+
+    def record(self, task_stats):
+        """終了したタスクの統計（process_warcの戻り値のtask_stats）を記録する"""
+        self.window_wall_time += task_stats.get("wall_time", 0.0)
+        self.window_cpu_time += task_stats.get("cpu_time", 0.0)
+        self.window_download_bytes += task_stats.get("download_bytes", 0)
+        self.window_tasks += 1
+
+    def update(self):
+        """
+        前回の調整からintervalが経過していればワーカー数を調整する
+        :return: 調整後のワーカー数
+        """
+        now = time.time()
+        if now - self.last_update < self.interval:
+            return self.target
+        self.last_update = now
+        self.window_intervals += 1
+
+        memory_ratio = read_memory_available_ratio()
+        load_ratio = read_load_ratio()
+        busy_ratio = self.window_cpu_time / self.window_wall_time if self.window_wall_time > 0 else None
+        throughput = self.window_download_bytes / max(now - self.window_start, 1e-9)
+        # 計測期間が短いうちは増やすかどうかを判断しない（減らす判断はすぐに行う）
+        evaluate = self.window_tasks > 0 and self.window_intervals >= self.evaluation_intervals
+
+        network_bound = busy_ratio is not None and busy_ratio < self.busy_threshold
+        if self.plateau_throughput is not None and evaluate and \
+                (not network_bound or throughput > self.plateau_throughput * (1 + self.throughput_margin)):
+            # ビジー率かスループットが変わったので、もう一度増やして様子を見る
+            print(f"Autoscale workers: leaving plateau at {self.plateau_throughput / 1024 / 1024:.1f} MiB/s")
+            self.plateau_throughput = None
+
+        action = 0
+        if memory_ratio is not None and memory_ratio < self.min_memory_available_ratio:
+            action = -1
+        elif load_ratio is not None and load_ratio > 1.0:
+            action = -1
+        elif not evaluate:
+            action = 0
+        elif network_bound and self.plateau_throughput is not None:
+            # 頭打ちの間は増やさない
+            action = 0
+        elif network_bound and self.last_action > 0 and self.last_throughput is not None and \
+                throughput <= self.last_throughput * (1 + self.throughput_margin):
+            # 前回増やしてもスループットが上がらなかった（Common Crawl側で制限されているなど）ので1つ戻す
+            self.plateau_throughput = max(throughput, self.last_throughput)
+            print(f"Autoscale workers: throughput plateaued at {self.plateau_throughput / 1024 / 1024:.1f} MiB/s")
+            action = -1
+        elif (load_ratio is None or load_ratio < 0.9) and \
+                (memory_ratio is None or memory_ratio >= self.min_memory_available_ratio * 2):
+            action = 1
+
+        new_target = max(self.min_workers, min(self.max_workers, self.target + action))
+        if new_target != self.target:
+            print(f"Autoscale workers: {self.target} -> {new_target} "
+                  f"(busy: {busy_ratio}, load: {load_ratio}, memory available: {memory_ratio}, "
+                  f"throughput: {throughput / 1024 / 1024:.1f} MiB/s)")
+        if evaluate or new_target != self.target:
+            self.last_action = new_target - self.target
+            # 計測期間が短いまま減らした場合のスループットは比較に使わない
+            self.last_throughput = throughput if evaluate else None
+            self.target = new_target
+            self._reset_window()
+        return self.target